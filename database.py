@@ -5,7 +5,10 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.write_concern import WriteConcern
+from bson import ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -18,15 +21,43 @@ load_dotenv()
 _client = None
 db = None
 
+class ObjectIdAsStr(TypeDecoder):
+    """Decode ObjectId values straight to strings so results are JSON ready"""
+    bson_type = ObjectId
+
+    def transform_bson(self, value):
+        return str(value)
+
+# tz_aware keeps datetimes read back from Mongo in UTC, matching the aware
+# timestamps the write endpoints echo
+CODEC_OPTIONS = CodecOptions(
+    tz_aware=True,
+    tzinfo=timezone.utc,
+    type_registry=TypeRegistry([ObjectIdAsStr()]),
+)
+
+# Collection handles with explicit write concerns. Chat messages are cheap to
+# lose compared to accounts and emails, so they skip the journal and majority
+# acknowledgement.
+FAST_WRITES = WriteConcern(w=1, j=False)
+DURABLE_WRITES = WriteConcern(w="majority", j=True)
+
+messages = None
+users = None
+emails = None
+
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+    _client = AsyncIOMotorClient(database_url, maxPoolSize=100, minPoolSize=10)
+    db = _client.get_database(database_name, codec_options=CODEC_OPTIONS)
+    messages = db.get_collection("message", write_concern=FAST_WRITES)
+    users = db.get_collection("user", write_concern=DURABLE_WRITES)
+    emails = db.get_collection("email", write_concern=DURABLE_WRITES)
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -37,13 +68,14 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +84,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
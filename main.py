@@ -1,24 +1,84 @@
+import logging
 import os
-from typing import List, Optional, Any, Dict
-from fastapi import FastAPI, HTTPException, Query
+import re
+from functools import lru_cache
+import orjson
+from cachetools import TTLCache
+from typing import Annotated, AsyncIterator, List, Optional, Any, Dict, Type
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr
+from fastapi.responses import ORJSONResponse as _ORJSONResponse, StreamingResponse
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field, field_serializer
+from pydantic.networks import validate_email
 from datetime import datetime, timezone
 from bson import ObjectId
+from bson.regex import Regex
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
 # Database helpers
-from database import db, create_document, get_documents
+from database import db, get_documents, messages, users, emails
 
-app = FastAPI(title="Chat & Email API")
+def orjson_default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+class ORJSONResponse(_ORJSONResponse):
+    """ORJSONResponse that also knows how to dump raw Mongo documents"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=orjson_default)
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Chat & Email API", default_response_class=ORJSONResponse)
+
+# Comma separated list of allowed origins; falls back to "*" when unset
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()] or ["*"]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=cors_origins,
+    # Credentials with a wildcard origin is invalid CORS, only allow them for explicit origins
+    allow_credentials=cors_origins != ["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,  # let browsers cache preflight responses for a day
 )
 
+async def create_index(collection: str, keys: Any, **kwargs: Any) -> bool:
+    # A missing index only costs speed, so a failure here (Mongo unreachable,
+    # duplicate emails left over from before the unique index) is logged
+    # instead of stopping the app from booting
+    try:
+        await db[collection].create_index(keys, **kwargs)
+    except PyMongoError as e:
+        logger.warning("Could not create index %s on %s: %s", keys, collection, e)
+        return False
+    return True
+
+async def drop_index(collection: str, name: str) -> None:
+    try:
+        await db[collection].drop_index(name)
+    except PyMongoError as e:
+        if getattr(e, "code", None) != 27:  # IndexNotFound: already gone
+            logger.warning("Could not drop index %s on %s: %s", name, collection, e)
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if db is None:
+        return
+    await create_index("user", "email", unique=True)
+    await create_index("conversation", [("participants", 1), ("updated_at", -1)])
+    await create_index("conversation", [("title", "text")])
+    # Supersedes (conversation_id, created_at) by adding _id as the keyset
+    # tiebreaker; the old index is only dropped once its replacement exists
+    if await create_index("message", [("conversation_id", 1), ("created_at", 1), ("_id", 1)]):
+        await drop_index("message", "conversation_id_1_created_at_1")
+    await create_index("email", [("recipients.owner", 1), ("recipients.folder", 1), ("created_at", -1)])
+    await create_index("email", [("subject", "text"), ("body", "text")])
+
 # --------- Utilities ---------
 class PyObjectId(ObjectId):
     @classmethod
@@ -33,24 +93,86 @@ class PyObjectId(ObjectId):
             raise ValueError("Invalid ObjectId")
         return ObjectId(v)
 
+def utc_now() -> datetime:
+    """Current UTC time truncated to the millisecond precision Mongo stores
+
+    Handlers echo the documents they write, so the timestamps they return have
+    to match what later reads (and keyset cursors) see.
+    """
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def oid(s: Optional[str]) -> Optional[ObjectId]:
+    """Parse an ObjectId once, returning None when the string isn't one"""
+    return ObjectId(s) if s and ObjectId.is_valid(s) else None
+
 def serialize_id(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # ObjectIds are decoded as strings by the client's codec options and the
+    # response models serialize datetimes, so only _id needs renaming here
     if not doc:
         return doc
     d = {**doc}
     if "_id" in d:
         d["id"] = str(d.pop("_id"))
-    # Convert any datetime to isoformat
-    for k, v in list(d.items()):
-        if isinstance(v, datetime):
-            d[k] = v.isoformat()
-        if isinstance(v, list):
-            d[k] = [str(x) if isinstance(x, ObjectId) else x for x in v]
     return d
 
+def make_etag(updated_at: Optional[datetime], count: Optional[int] = None) -> str:
+    """Weak ETag from a last-modified timestamp, plus a document count for lists"""
+    millis = int(updated_at.timestamp() * 1000) if updated_at else 0
+    return f'W/"{millis}"' if count is None else f'W/"{millis}-{count}"'
+
+async def stream_json_array(cursor) -> Response:
+    """Stream a cursor as a JSON array, one document at a time as batches arrive
+
+    The first document is fetched before the response starts, so a failing
+    query still turns into a proper error status instead of a truncated 200.
+    """
+    try:
+        first = await cursor.__anext__()
+    except StopAsyncIteration:
+        return ORJSONResponse([])
+
+    async def body() -> AsyncIterator[bytes]:
+        yield b"[" + orjson.dumps(first, default=orjson_default)
+        async for doc in cursor:
+            yield b"," + orjson.dumps(doc, default=orjson_default)
+        yield b"]"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+# --------- Projections ---------
+# Only the fields the list views render are pulled from Mongo.
+# Streamed and search results skip serialize_id: Mongo renames _id itself and
+# the documents go straight to orjson, which dumps datetimes and ObjectIds natively.
+ID_AS_STRING = {"_id": 0, "id": {"$toString": "$_id"}}
+CONVERSATION_LIST_FIELDS = {"title": 1, "participants": 1, "last_message": 1, "updated_at": 1}
+MESSAGE_LIST_FIELDS = {**ID_AS_STRING, "conversation_id": 1, "sender_id": 1, "content": 1, "created_at": 1}
+SEARCH_CONVERSATION_FIELDS = {**ID_AS_STRING, "title": 1, "updated_at": 1}
+# Per-mailbox state stays out of search results; it belongs to other users
+SEARCH_EMAIL_FIELDS = {**ID_AS_STRING, "subject": 1, "sender": 1, "created_at": 1}
+
+def fields_projection(fields: Optional[str], model: Type[BaseModel]) -> Optional[Dict[str, int]]:
+    """Build a projection from a comma separated field list; None returns every field"""
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return {name: 1 for name in names} or None
+
 # --------- Models (Requests) ---------
+@lru_cache(maxsize=10_000)
+def _validate_email(value: str) -> str:
+    # Same check as EmailStr, but repeat addresses (mailing-list CCs, the same
+    # sender) skip the email-validator parse
+    return validate_email(value)[1]
+
+Email = Annotated[str, AfterValidator(_validate_email)]
+
 class CreateUser(BaseModel):
     name: str
-    email: EmailStr
+    email: Email
 
 class CreateConversation(BaseModel):
     participant_ids: List[str] = Field(..., min_items=2)
@@ -61,25 +183,77 @@ class SendMessage(BaseModel):
     sender_id: str
     content: str
 
+MAX_RECIPIENTS = 100  # per address list, bounds validation work on bulk sends
+
 class SendEmail(BaseModel):
-    sender: EmailStr
-    to: List[EmailStr]
+    sender: Email
+    to: List[Email] = Field(..., max_length=MAX_RECIPIENTS)
     subject: str
     body: str
-    cc: Optional[List[EmailStr]] = []
-    bcc: Optional[List[EmailStr]] = []
+    cc: Optional[List[Email]] = Field([], max_length=MAX_RECIPIENTS)
+    bcc: Optional[List[Email]] = Field([], max_length=MAX_RECIPIENTS)
 
 class UpdateEmailStatus(BaseModel):
     read: Optional[bool] = None
     folder: Optional[str] = None  # inbox, sent, drafts, trash, archived
 
+# --------- Models (Responses) ---------
+# Documents coming back from Mongo are trusted, so handlers build these with
+# model_construct and skip validation. Every field is optional so projected
+# queries can leave fields out; response_model_exclude_none drops them.
+class DocumentOut(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # isoformat (+00:00) matches what orjson writes on the streamed and search
+    # routes, pydantic's own datetime output would use a Z suffix instead
+    @field_serializer("created_at", "updated_at", check_fields=False)
+    def serialize_timestamp(self, value: Optional[datetime]) -> Optional[str]:
+        return value.isoformat() if value else None
+
+class UserOut(DocumentOut):
+    id: Optional[str] = None
+    name: Optional[str] = None
+    email: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class ConversationOut(DocumentOut):
+    id: Optional[str] = None
+    participants: Optional[List[str]] = None
+    title: Optional[str] = None
+    last_message: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class MessageOut(DocumentOut):
+    id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    sender_id: Optional[str] = None
+    content: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class EmailOut(DocumentOut):
+    id: Optional[str] = None
+    sender: Optional[str] = None
+    to: Optional[List[str]] = None
+    cc: Optional[List[str]] = None
+    bcc: Optional[List[str]] = None
+    subject: Optional[str] = None
+    body: Optional[str] = None
+    read: Optional[bool] = None
+    folder: Optional[str] = None
+    owner: Optional[str] = None
+    recipients: Optional[List[Dict[str, Any]]] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 # --------- Routes ---------
 @app.get("/")
-def root():
+async def root():
     return {"message": "Chat & Email API running"}
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -93,7 +267,7 @@ def test_database():
             response["database"] = "✅ Available"
             response["connection_status"] = "Connected"
             try:
-                response["collections"] = db.list_collection_names()
+                response["collections"] = await db.list_collection_names()
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️ Connected but Error: {str(e)[:80]}"
@@ -104,149 +278,317 @@ def test_database():
     return response
 
 # Users
-@app.post("/api/users")
-def create_user(payload: CreateUser):
-    existing = db["user"].find_one({"email": payload.email}) if db else None
-    if existing:
+@app.post("/api/users", response_model=UserOut, response_model_exclude_none=True)
+async def create_user(payload: CreateUser):
+    now = utc_now()
+    doc = {"name": payload.name, "email": payload.email, "created_at": now, "updated_at": now}
+    # Check-and-insert in one atomic call; the unique index on email guards races
+    try:
+        res = await users.update_one({"email": payload.email}, {"$setOnInsert": doc}, upsert=True)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already exists")
+    if res.upserted_id is None:
         raise HTTPException(status_code=400, detail="Email already exists")
-    user_id = create_document("user", {"name": payload.name, "email": payload.email})
-    doc = db["user"].find_one({"_id": ObjectId(user_id)})
-    return serialize_id(doc)
+    doc["_id"] = res.upserted_id
+    return UserOut.model_construct(**serialize_id(doc))
 
-@app.get("/api/users")
-def list_users():
-    docs = get_documents("user") if db else []
-    return [serialize_id(d) for d in docs]
+@app.get("/api/users", response_model=List[UserOut], response_model_exclude_none=True)
+async def list_users():
+    docs = await get_documents("user") if db is not None else []
+    return [UserOut.model_construct(**serialize_id(d)) for d in docs]
 
 # Conversations & Messages
-@app.post("/api/conversations")
-def create_conversation(payload: CreateConversation):
+# Conversation headers are re-read on every chat view; a short TTL keeps other
+# workers' copies from going stale for long, send_message evicts locally.
+conversation_cache: TTLCache = TTLCache(maxsize=10_000, ttl=5)
+
+@app.post("/api/conversations", response_model=ConversationOut, response_model_exclude_none=True)
+async def create_conversation(payload: CreateConversation):
+    now = utc_now()
     # Validate participants
-    participant_oids = []
-    for pid in payload.participant_ids:
-        if not ObjectId.is_valid(pid):
-            raise HTTPException(status_code=400, detail="Invalid participant id")
-        participant_oids.append(ObjectId(pid))
+    participant_oids = [oid(pid) for pid in payload.participant_ids]
+    if not all(participant_oids):
+        raise HTTPException(status_code=400, detail="Invalid participant id")
     conv = {
         "participants": participant_oids,
         "title": payload.title or "Conversation",
         "last_message": None,
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "created_at": now,
+        "updated_at": now,
     }
-    res = db["conversation"].insert_one(conv)
-    doc = db["conversation"].find_one({"_id": res.inserted_id})
-    return serialize_id(doc)
+    res = await db["conversation"].insert_one(conv)
+    conv["_id"] = res.inserted_id
+    # conv still holds the ObjectIds we encoded, echo the ids as sent
+    return ConversationOut.model_construct(**serialize_id({**conv, "participants": payload.participant_ids}))
 
-@app.get("/api/conversations")
-def list_conversations(user_id: Optional[str] = Query(None)):
+@app.get("/api/conversations", response_model=List[ConversationOut], response_model_exclude_none=True)
+async def list_conversations(request: Request, response: Response, user_id: Optional[str] = Query(None)):
     filt = {}
-    if user_id and ObjectId.is_valid(user_id):
-        filt = {"participants": ObjectId(user_id)}
-    docs = list(db["conversation"].find(filt).sort("updated_at", -1))
-    return [serialize_id(d) for d in docs]
-
-@app.get("/api/conversations/{conversation_id}")
-def get_conversation(conversation_id: str):
-    if not ObjectId.is_valid(conversation_id):
+    user_oid = oid(user_id)
+    if user_oid:
+        filt = {"participants": user_oid}
+    docs = await db["conversation"].find(filt, CONVERSATION_LIST_FIELDS).sort("updated_at", -1).to_list(length=None)
+    # Sorted newest first, so the first document carries the latest change
+    etag = make_etag(docs[0].get("updated_at") if docs else None, len(docs))
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return [ConversationOut.model_construct(**serialize_id(d)) for d in docs]
+
+@app.get("/api/conversations/{conversation_id}", response_model=ConversationOut, response_model_exclude_none=True)
+async def get_conversation(conversation_id: str, request: Request, response: Response):
+    conv_oid = oid(conversation_id)
+    if not conv_oid:
         raise HTTPException(status_code=400, detail="Invalid id")
-    doc = db["conversation"].find_one({"_id": ObjectId(conversation_id)})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Not found")
-    return serialize_id(doc)
+    doc = conversation_cache.get(conv_oid)
+    if doc is None:
+        doc = await db["conversation"].find_one({"_id": conv_oid})
+        if not doc:
+            raise HTTPException(status_code=404, detail="Not found")
+        conversation_cache[conv_oid] = doc
+    etag = make_etag(doc.get("updated_at"))
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return ConversationOut.model_construct(**serialize_id(doc))
 
-@app.get("/api/conversations/{conversation_id}/messages")
-def list_messages(conversation_id: str):
-    if not ObjectId.is_valid(conversation_id):
+# Streamed routes bypass response_model, so the schema is only documented here
+@app.get("/api/conversations/{conversation_id}/messages", response_model=None, responses={200: {"model": List[MessageOut]}})
+async def list_messages(
+    conversation_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    before: Optional[str] = Query(None, description="created_at of the last message on the previous page"),
+    before_id: Optional[str] = Query(None, description="id of the last message on the previous page"),
+):
+    conv_oid = oid(conversation_id)
+    if not conv_oid:
         raise HTTPException(status_code=400, detail="Invalid id")
-    msgs = list(db["message"].find({"conversation_id": ObjectId(conversation_id)}).sort("created_at", 1))
-    return [serialize_id(m) for m in msgs]
+    filt: Dict[str, Any] = {"conversation_id": conv_oid}
+    if before:
+        try:
+            before_at = datetime.fromisoformat(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid before timestamp")
+        if before_id is None:
+            filt["created_at"] = {"$lt": before_at}
+        else:
+            # _id breaks ties between messages sharing a created_at millisecond
+            before_oid = oid(before_id)
+            if not before_oid:
+                raise HTTPException(status_code=400, detail="Invalid before_id")
+            filt["$or"] = [
+                {"created_at": {"$lt": before_at}},
+                {"created_at": before_at, "_id": {"$lt": before_oid}},
+            ]
+    elif before_id is not None:
+        raise HTTPException(status_code=400, detail="before_id requires before")
+    # Newest first, walked by the (conversation_id, created_at, _id) index; pass
+    # the last message's created_at and id back as before/before_id for the next page
+    cursor = (
+        db["message"].find(filt, MESSAGE_LIST_FIELDS)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit)
+        .batch_size(limit)
+    )
+    return await stream_json_array(cursor)
 
-@app.post("/api/messages")
-def send_message(payload: SendMessage):
-    if not ObjectId.is_valid(payload.conversation_id) or not ObjectId.is_valid(payload.sender_id):
+@app.post("/api/messages", response_model=MessageOut, response_model_exclude_none=True)
+async def send_message(payload: SendMessage):
+    conv_oid = oid(payload.conversation_id)
+    sender_oid = oid(payload.sender_id)
+    if not (conv_oid and sender_oid):
         raise HTTPException(status_code=400, detail="Invalid ids")
+    now = utc_now()
     message = {
-        "conversation_id": ObjectId(payload.conversation_id),
-        "sender_id": ObjectId(payload.sender_id),
+        "conversation_id": conv_oid,
+        "sender_id": sender_oid,
         "content": payload.content,
-        "created_at": datetime.now(timezone.utc),
+        "created_at": now,
     }
-    res = db["message"].insert_one(message)
+    res = await messages.insert_one(message)
     # Update conversation last_message and updated_at
-    db["conversation"].update_one(
-        {"_id": ObjectId(payload.conversation_id)},
-        {"$set": {"last_message": payload.content, "updated_at": datetime.now(timezone.utc)}}
+    await db["conversation"].update_one(
+        {"_id": conv_oid},
+        {"$set": {"last_message": payload.content, "updated_at": now}}
     )
-    doc = db["message"].find_one({"_id": res.inserted_id})
-    return serialize_id(doc)
+    conversation_cache.pop(conv_oid, None)
+    message["_id"] = res.inserted_id
+    return MessageOut.model_construct(**serialize_id({
+        **message,
+        "conversation_id": payload.conversation_id,
+        "sender_id": payload.sender_id,
+    }))
 
 # Email endpoints
-@app.post("/api/emails")
-def create_email(payload: SendEmail):
+# Each email is stored once; per-mailbox state lives in the recipients array,
+# one {owner, folder, read} entry for the sender and for every "to" address.
+def recipient_view(doc: Dict[str, Any], owner: str, folder: str) -> Dict[str, Any]:
+    """Flatten one mailbox's recipient entry onto the email document"""
+    entry = next((r for r in doc.get("recipients", []) if r["owner"] == owner and r["folder"] == folder), None)
+    if entry is None:
+        return doc
+    d = {k: v for k, v in doc.items() if k != "recipients"}
+    d.update(entry)
+    return d
+
+EMAIL_RECIPIENTS_MIGRATION = "email_recipients"
+
+@app.on_event("startup")
+async def migrate_legacy_emails():
+    """Move emails stored in the old one-copy-per-mailbox shape into recipients
+
+    Old copies carried top-level owner/folder/read (the sender's copy had no
+    owner). Each copy keeps its own document and gets a single recipients entry
+    for its mailbox, so every mailbox sees the same emails as before. A marker
+    in the migration collection records completion, so later boots skip the
+    collection scan.
+    """
+    if db is None:
+        return
+    try:
+        if await db["migration"].find_one({"_id": EMAIL_RECIPIENTS_MIGRATION}):
+            return
+        await db["email"].update_many(
+            {"recipients": {"$exists": False}},
+            [
+                {"$set": {"recipients": [{
+                    "owner": {"$ifNull": ["$owner", "$sender"]},
+                    "folder": {"$ifNull": ["$folder", "inbox"]},
+                    "read": {"$ifNull": ["$read", False]},
+                }]}},
+                {"$unset": ["owner", "folder", "read"]},
+            ],
+        )
+        await db["migration"].update_one(
+            {"_id": EMAIL_RECIPIENTS_MIGRATION},
+            {"$setOnInsert": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        logger.warning("Email recipients migration failed, will retry on next start: %s", e)
+
+@app.post("/api/emails", response_model=EmailOut, response_model_exclude_none=True)
+async def create_email(payload: SendEmail):
+    now = utc_now()
+    # Addresses were validated with the payload, use them as plain strings
+    sender = payload.sender
+    to = payload.to
     email_doc = {
-        "sender": str(payload.sender),
-        "to": [str(x) for x in payload.to],
-        "cc": [str(x) for x in (payload.cc or [])],
-        "bcc": [str(x) for x in (payload.bcc or [])],
+        "sender": sender,
+        "to": to,
+        "cc": payload.cc or [],
+        "bcc": payload.bcc or [],
         "subject": payload.subject,
         "body": payload.body,
-        "read": False,
-        "folder": "sent",  # sender's perspective
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "recipients": [{"owner": sender, "folder": "sent", "read": False}]
+        # dict.fromkeys drops repeated addresses so each inbox gets one entry
+        + [{"owner": r, "folder": "inbox", "read": False} for r in dict.fromkeys(to)],
+        "created_at": now,
+        "updated_at": now,
     }
-    res = db["email"].insert_one(email_doc)
-    # Also create copies for recipients in their inbox folder
-    inbox_docs = []
-    now = datetime.now(timezone.utc)
-    for recipient in email_doc["to"]:
-        inbox_docs.append({**email_doc, "_id": None, "folder": "inbox", "owner": recipient, "created_at": now, "updated_at": now})
-    if inbox_docs:
-        # remove _id None handling
-        for d in inbox_docs:
-            d.pop("_id", None)
-        db["email"].insert_many(inbox_docs)
-    return serialize_id(db["email"].find_one({"_id": res.inserted_id}))
-
-@app.get("/api/emails")
-def list_emails(owner: Optional[str] = Query(None), folder: Optional[str] = Query(None)):
-    filt: Dict[str, Any] = {}
+    # A single write covers the sender and every recipient mailbox
+    res = await emails.insert_one(email_doc)
+    email_doc["_id"] = res.inserted_id
+    return EmailOut.model_construct(**serialize_id(recipient_view(email_doc, sender, "sent")))
+
+@app.get("/api/emails", response_model=None, responses={200: {"model": List[EmailOut]}})
+async def list_emails(
+    owner: Optional[str] = Query(None),
+    folder: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. subject,sender,read"),
+):
+    recipient: Dict[str, Any] = {}
     if owner:
-        filt["owner"] = owner
+        recipient["owner"] = owner
     if folder:
-        filt["folder"] = folder
-    docs = list(db["email"].find(filt).sort("created_at", -1))
-    return [serialize_id(d) for d in docs]
+        recipient["folder"] = folder
+    pipeline: List[Dict[str, Any]] = []
+    if recipient:
+        pipeline.append({"$match": {"recipients": {"$elemMatch": recipient}}})
+    # Sort before unwinding so the created_at index order can be used
+    pipeline += [{"$sort": {"created_at": -1}}, {"$unwind": "$recipients"}]
+    if recipient:
+        pipeline.append({"$match": {f"recipients.{k}": v for k, v in recipient.items()}})
+    pipeline += [
+        {"$set": {
+            "owner": "$recipients.owner",
+            "folder": "$recipients.folder",
+            "read": "$recipients.read",
+            "id": {"$toString": "$_id"},
+        }},
+        {"$unset": ["recipients", "_id"]},
+    ]
+    projection = fields_projection(fields, EmailOut)
+    if projection:
+        pipeline.append({"$project": {"id": 1, **projection}})
+    cursor = db["email"].aggregate(pipeline)
+    return await stream_json_array(cursor)
 
-@app.patch("/api/emails/{email_id}")
-def update_email(email_id: str, payload: UpdateEmailStatus):
-    if not ObjectId.is_valid(email_id):
+@app.patch("/api/emails/{email_id}", response_model=EmailOut, response_model_exclude_none=True)
+async def update_email(
+    email_id: str,
+    payload: UpdateEmailStatus,
+    owner: Optional[str] = Query(None, description="Mailbox owner whose copy is updated"),
+    mailbox: Optional[str] = Query(None, description="Folder the email is currently in for that owner"),
+):
+    eid = oid(email_id)
+    if not eid:
         raise HTTPException(status_code=400, detail="Invalid id")
-    updates: Dict[str, Any] = {"updated_at": datetime.now(timezone.utc)}
+    # The email document is shared by every mailbox, so the caller has to say
+    # which entry it means; a sender who mailed themselves has both a sent and
+    # an inbox entry, hence the folder as well as the owner
+    if not owner or not mailbox:
+        raise HTTPException(status_code=400, detail="owner and mailbox are required")
+    updates: Dict[str, Any] = {"updated_at": utc_now()}
     if payload.read is not None:
-        updates["read"] = payload.read
+        updates["recipients.$[r].read"] = payload.read
     if payload.folder is not None:
-        updates["folder"] = payload.folder
-    res = db["email"].update_one({"_id": ObjectId(email_id)}, {"$set": updates})
-    if res.matched_count == 0:
+        updates["recipients.$[r].folder"] = payload.folder
+    doc = await db["email"].find_one_and_update(
+        {"_id": eid, "recipients": {"$elemMatch": {"owner": owner, "folder": mailbox}}},
+        {"$set": updates},
+        array_filters=[{"r.owner": owner, "r.folder": mailbox}],
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
         raise HTTPException(status_code=404, detail="Not found")
-    doc = db["email"].find_one({"_id": ObjectId(email_id)})
-    return serialize_id(doc)
+    return EmailOut.model_construct(**serialize_id(recipient_view(doc, owner, payload.folder or mailbox)))
 
 # Optional: simple search
+SEARCH_MIN_LEN = 3  # anything shorter matches nearly every document
+SEARCH_PREFIX_MAX_LEN = 4  # short queries rarely match whole words, fall back to a prefix regex
+TEXT_SCORE = {"$meta": "textScore"}
+
 @app.get("/api/search")
-def search(q: str = Query("")):
-    if not q:
+async def search(q: str = Query("")):
+    q = q.strip()
+    if len(q) < SEARCH_MIN_LEN:
         return {"conversations": [], "emails": []}
-    convs = list(db["conversation"].find({"title": {"$regex": q, "$options": "i"}}).limit(10))
-    emails = list(db["email"].find({"$or": [{"subject": {"$regex": q, "$options": "i"}}, {"body": {"$regex": q, "$options": "i"}}]}).limit(10))
-    return {
-        "conversations": [serialize_id(c) for c in convs],
-        "emails": [serialize_id(e) for e in emails]
-    }
+    if len(q) <= SEARCH_PREFIX_MAX_LEN:
+        # Escaped and anchored so user input can't build a pathological pattern
+        prefix = Regex(f"^{re.escape(q)}", "i")
+        convs = await db["conversation"].find({"title": prefix}, SEARCH_CONVERSATION_FIELDS).limit(10).to_list(length=None)
+        mails = await db["email"].find({"subject": prefix}, SEARCH_EMAIL_FIELDS).limit(10).to_list(length=None)
+    else:
+        text = {"$text": {"$search": q}}
+        # Sorting on textScore doesn't need it projected, so the score stays server side
+        convs = await db["conversation"].find(text, SEARCH_CONVERSATION_FIELDS).sort([("score", TEXT_SCORE)]).limit(10).to_list(length=None)
+        mails = await db["email"].find(text, SEARCH_EMAIL_FIELDS).sort([("score", TEXT_SCORE)]).limit(10).to_list(length=None)
+    return ORJSONResponse({"conversations": convs, "emails": mails})
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker opens its own Mongo pool (up to 100 connections), so the
+    # default is capped rather than following the core count
+    workers = int(os.getenv("WORKERS") or min(os.cpu_count() or 1, 4))
+    # Multiple workers need an import string rather than the app object
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
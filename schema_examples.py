@@ -12,7 +12,7 @@ from database import create_document, get_documents, update_document, delete_doc
 # USER MANAGEMENT SCHEMA
 # =============================================================================
 
-def create_user(name: str, email: str, password_hash: str):
+async def create_user(name: str, email: str, password_hash: str):
     """Create a new user"""
     user_data = {
         "name": name,
@@ -29,18 +29,18 @@ def create_user(name: str, email: str, password_hash: str):
         },
         "status": "active"
     }
-    return create_document("users", user_data)
+    return await create_document("users", user_data)
 
-def get_user_by_email(email: str):
+async def get_user_by_email(email: str):
     """Get user by email"""
-    users = get_documents("users", {"email": email})
+    users = await get_documents("users", {"email": email})
     return users[0] if users else None
 
 # =============================================================================
 # BLOG/CMS SCHEMA
 # =============================================================================
 
-def create_blog_post(title: str, content: str, author_id: str, tags: list = None):
+async def create_blog_post(title: str, content: str, author_id: str, tags: list = None):
     """Create a blog post"""
     post_data = {
         "title": title,
@@ -53,9 +53,9 @@ def create_blog_post(title: str, content: str, author_id: str, tags: list = None
         "likes": 0,
         "comments": []
     }
-    return create_document("posts", post_data)
+    return await create_document("posts", post_data)
 
-def add_comment_to_post(post_id: str, author_id: str, comment_text: str):
+async def add_comment_to_post(post_id: str, author_id: str, comment_text: str):
     """Add comment to a blog post"""
     from bson import ObjectId
     
@@ -69,7 +69,7 @@ def add_comment_to_post(post_id: str, author_id: str, comment_text: str):
     
     # Add comment to post's comments array
     from database import db
-    result = db.posts.update_one(
+    result = await db.posts.update_one(
         {"_id": ObjectId(post_id)},
         {"$push": {"comments": comment}}
     )
@@ -79,7 +79,7 @@ def add_comment_to_post(post_id: str, author_id: str, comment_text: str):
 # E-COMMERCE SCHEMA
 # =============================================================================
 
-def create_product(name: str, price: float, description: str, category: str):
+async def create_product(name: str, price: float, description: str, category: str):
     """Create a product"""
     product_data = {
         "name": name,
@@ -100,9 +100,9 @@ def create_product(name: str, price: float, description: str, category: str):
             "count": 0
         }
     }
-    return create_document("products", product_data)
+    return await create_document("products", product_data)
 
-def create_order(user_id: str, items: list, shipping_address: dict):
+async def create_order(user_id: str, items: list, shipping_address: dict):
     """Create an order"""
     total_amount = sum(item["price"] * item["quantity"] for item in items)
     
@@ -124,13 +124,13 @@ def create_order(user_id: str, items: list, shipping_address: dict):
             "status": "processing"
         }
     }
-    return create_document("orders", order_data)
+    return await create_document("orders", order_data)
 
 # =============================================================================
 # TASK/PROJECT MANAGEMENT SCHEMA
 # =============================================================================
 
-def create_project(name: str, description: str, owner_id: str):
+async def create_project(name: str, description: str, owner_id: str):
     """Create a project"""
     project_data = {
         "name": name,
@@ -146,9 +146,9 @@ def create_project(name: str, description: str, owner_id: str):
             "allow_comments": True
         }
     }
-    return create_document("projects", project_data)
+    return await create_document("projects", project_data)
 
-def create_task(project_id: str, title: str, description: str, assignee_id: str = None):
+async def create_task(project_id: str, title: str, description: str, assignee_id: str = None):
     """Create a task"""
     task_data = {
         "project_id": project_id,
@@ -166,13 +166,13 @@ def create_task(project_id: str, title: str, description: str, assignee_id: str
         "checklist": [],
         "attachments": []
     }
-    return create_document("tasks", task_data)
+    return await create_document("tasks", task_data)
 
 # =============================================================================
 # CHAT/MESSAGING SCHEMA
 # =============================================================================
 
-def create_chat_room(name: str, type: str = "group", members: list = None):
+async def create_chat_room(name: str, type: str = "group", members: list = None):
     """Create a chat room"""
     room_data = {
         "name": name,
@@ -186,9 +186,9 @@ def create_chat_room(name: str, type: str = "group", members: list = None):
         },
         "last_activity": datetime.utcnow()
     }
-    return create_document("chat_rooms", room_data)
+    return await create_document("chat_rooms", room_data)
 
-def send_message(room_id: str, sender_id: str, content: str, message_type: str = "text"):
+async def send_message(room_id: str, sender_id: str, content: str, message_type: str = "text"):
     """Send a message to a chat room"""
     message_data = {
         "room_id": room_id,
@@ -200,13 +200,13 @@ def send_message(room_id: str, sender_id: str, content: str, message_type: str =
         "is_edited": False,
         "is_deleted": False
     }
-    return create_document("messages", message_data)
+    return await create_document("messages", message_data)
 
 # =============================================================================
 # EVENT/BOOKING SCHEMA
 # =============================================================================
 
-def create_event(title: str, description: str, start_time: datetime, end_time: datetime, location: str):
+async def create_event(title: str, description: str, start_time: datetime, end_time: datetime, location: str):
     """Create an event"""
     event_data = {
         "title": title,
@@ -227,9 +227,9 @@ def create_event(title: str, description: str, start_time: datetime, end_time: d
             "send_reminders": True
         }
     }
-    return create_document("events", event_data)
+    return await create_document("events", event_data)
 
-def create_booking(event_id: str, user_id: str, ticket_quantity: int = 1):
+async def create_booking(event_id: str, user_id: str, ticket_quantity: int = 1):
     """Create a booking for an event"""
     booking_data = {
         "event_id": event_id,
@@ -245,13 +245,13 @@ def create_booking(event_id: str, user_id: str, ticket_quantity: int = 1):
         "attendee_details": [],
         "special_requirements": ""
     }
-    return create_document("bookings", booking_data)
+    return await create_document("bookings", booking_data)
 
 # =============================================================================
 # ANALYTICS/TRACKING SCHEMA
 # =============================================================================
 
-def track_user_activity(user_id: str, action: str, resource_type: str, resource_id: str, metadata: dict = None):
+async def track_user_activity(user_id: str, action: str, resource_type: str, resource_id: str, metadata: dict = None):
     """Track user activity for analytics"""
     activity_data = {
         "user_id": user_id,
@@ -264,9 +264,9 @@ def track_user_activity(user_id: str, action: str, resource_type: str, resource_
         "session_id": None,
         "timestamp": datetime.utcnow()
     }
-    return create_document("user_activities", activity_data)
+    return await create_document("user_activities", activity_data)
 
-def track_page_view(page_path: str, user_id: str = None, session_id: str = None):
+async def track_page_view(page_path: str, user_id: str = None, session_id: str = None):
     """Track page views for analytics"""
     pageview_data = {
         "page_path": page_path,
@@ -284,13 +284,13 @@ def track_page_view(page_path: str, user_id: str = None, session_id: str = None)
         },
         "timestamp": datetime.utcnow()
     }
-    return create_document("page_views", pageview_data)
+    return await create_document("page_views", pageview_data)
 
 # =============================================================================
 # NOTIFICATION SCHEMA
 # =============================================================================
 
-def create_notification(user_id: str, title: str, message: str, type: str = "info"):
+async def create_notification(user_id: str, title: str, message: str, type: str = "info"):
     """Create a notification"""
     notification_data = {
         "user_id": user_id,
@@ -301,25 +301,25 @@ def create_notification(user_id: str, title: str, message: str, type: str = "inf
         "action_url": None,
         "metadata": {}
     }
-    return create_document("notifications", notification_data)
+    return await create_document("notifications", notification_data)
 
 # =============================================================================
 # USAGE EXAMPLES
 # =============================================================================
 
 if __name__ == "__main__":
-    # Example usage - uncomment to test
+    # Example usage - uncomment to test (helpers are async, run them with asyncio.run)
     
     # Create a user
-    # user_id = create_user("John Doe", "john@example.com", "hashed_password")
+    # user_id = asyncio.run(create_user("John Doe", "john@example.com", "hashed_password"))
     
     # Create a blog post
-    # post_id = create_blog_post("My First Post", "This is the content", user_id, ["tech", "python"])
+    # post_id = asyncio.run(create_blog_post("My First Post", "This is the content", user_id, ["tech", "python"]))
     
     # Create a product
-    # product_id = create_product("iPhone 15", 999.99, "Latest iPhone", "Electronics")
+    # product_id = asyncio.run(create_product("iPhone 15", 999.99, "Latest iPhone", "Electronics"))
     
     # Track user activity
-    # track_user_activity(user_id, "create", "post", post_id, {"category": "blog"})
+    # asyncio.run(track_user_activity(user_id, "create", "post", post_id, {"category": "blog"}))
     
     pass
\ No newline at end of file